@@ -1,9 +1,32 @@
 import streamlit as st
 import pandas as pd
-import anthropic
-from docx import Document
+import numpy as np
+import orjson
+import asyncio
+import hashlib
+import importlib.util
 import io
-import json
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Run children that stand for whitespace rather than carrying text
+WORD_BREAKS = {WORD_NS + 'tab': '\t', WORD_NS + 'br': '\n', WORD_NS + 'cr': '\n'}
+# Header patterns in order of precedence, each target column is assigned at most once
+STANDARDS_COLUMN_RULES = [
+    (re.compile(r'^id\b|[\W_]id\b|standard.?id|identifier', re.I), 'ID'),
+    # camelCase suffix such as ReqID, case-sensitive so Valid or Android do not match
+    (re.compile(r'[a-z]I[Dd]$'), 'ID'),
+    (re.compile(r'category|type', re.I), 'Category'),
+    (re.compile(r'requirement|standard$', re.I), 'Requirement'),
+    (re.compile(r'description|detail', re.I), 'Description'),
+]
+# Optional ```json fence around the model response; either fence may be missing
+CODE_FENCE_RE = re.compile(r'^\s*(?:```(?:json)?)?\s*(.*?)\s*(?:```\s*)?$', re.S | re.I)
 
 # Page config
 st.set_page_config(page_title="Application Compliance Checker", page_icon="📋", layout="wide")
@@ -15,21 +38,72 @@ if 'app_content' not in st.session_state:
     st.session_state.app_content = None
 if 'findings' not in st.session_state:
     st.session_state.findings = None
+if 'analysis_future' not in st.session_state:
+    st.session_state.analysis_future = None
+if 'analysis_progress' not in st.session_state:
+    st.session_state.analysis_progress = None
+if 'app_file_id' not in st.session_state:
+    st.session_state.app_file_id = None
+if 'standards_file_id' not in st.session_state:
+    st.session_state.standards_file_id = None
+
+def _run_text(run):
+    """Text of a w:r run, with tabs and line breaks kept as whitespace"""
+    # Only run children count, w:tab also appears in paragraph properties as a tab stop
+    return ''.join(
+        child.text or '' if child.tag == WORD_NS + 't' else WORD_BREAKS.get(child.tag, '')
+        for child in run
+    )
 
 def read_docx(file):
     """Extract text from DOCX file"""
-    doc = Document(file)
-    full_text = []
-    for para in doc.paragraphs:
-        full_text.append(para.text)
-    return '\n'.join(full_text)
+    try:
+        from lxml import etree as ET
+    except ImportError:
+        import xml.etree.ElementTree as ET
+    
+    paragraphs = []
+    # Stream word/document.xml and pull the text runs out of each paragraph
+    with zipfile.ZipFile(file) as docx, docx.open('word/document.xml') as xml:
+        for _, el in ET.iterparse(xml, events=('end',)):
+            if el.tag == WORD_NS + 'p':
+                text = ''.join(_run_text(run) for run in el.iter(WORD_NS + 'r'))
+                # Skip empty paragraphs, they only add newline noise to the prompt
+                if text:
+                    paragraphs.append(text)
+                el.clear()
+    return '\n'.join(paragraphs)
+
+def _is_standards_column(col):
+    """Whether a header could map to one of the standards columns"""
+    col = str(col).strip()
+    return any(pattern.search(col) for pattern, _ in STANDARDS_COLUMN_RULES)
+
+def _read_standards_csv(file):
+    """Read a standards CSV with the pyarrow engine, falling back to the default parser"""
+    try:
+        # The pyarrow engine only accepts column names for usecols, so read the header first
+        columns = pd.read_csv(file, nrows=0).columns
+        file.seek(0)
+        usecols = [col for col in columns if _is_standards_column(col)]
+        return pd.read_csv(file, engine='pyarrow', dtype_backend='pyarrow', usecols=usecols)
+    except (ImportError, ValueError, KeyError):
+        # pyarrow is stricter than the C parser: rows missing the trailing Description
+        # raise ArrowInvalid (a ValueError) instead of being padded, and duplicate headers
+        # renamed by the header read raise ArrowKeyError (a KeyError)
+        file.seek(0)
+        return pd.read_csv(file, usecols=_is_standards_column)
 
 def read_standards_file(file):
     """Read standards from CSV or Excel file"""
+    # Only parse columns that can map to a standards field, auxiliary columns are skipped
     if file.name.endswith('.csv'):
-        df = pd.read_csv(file)
+        df = _read_standards_csv(file)
     elif file.name.endswith(('.xlsx', '.xls')):
-        df = pd.read_excel(file)
+        # pandas opens xlsx workbooks with openpyxl in read-only, data-only mode
+        engine = 'xlrd' if file.name.endswith('.xls') else 'openpyxl'
+        with pd.ExcelFile(file, engine=engine) as xlf:
+            df = xlf.parse(xlf.sheet_names[0], usecols=_is_standards_column)
     else:
         st.error("Unsupported file format. Please upload CSV or Excel file.")
         return None
@@ -37,45 +111,96 @@ def read_standards_file(file):
     # Standardize column names
     df.columns = df.columns.str.strip()
     
-    # Check for required columns (flexible naming)
-    required_cols = ['id', 'category', 'requirement']
+    # Map columns to the standard names (flexible naming). The first matching rule
+    # decides a header's target; headers that already are a standard name claim it
+    # first, then headers matched by earlier rules, then column order breaks ties
+    targets = {target.lower() for _, target in STANDARDS_COLUMN_RULES}
+    ranks = {
+        col: next((i for i, (pattern, _) in enumerate(STANDARDS_COLUMN_RULES) if pattern.search(col)), None)
+        for col in df.columns
+    }
     col_mapping = {}
+    for col in sorted((c for c in df.columns if ranks[c] is not None), key=lambda c: (c.lower() not in targets, ranks[c])):
+        target = STANDARDS_COLUMN_RULES[ranks[col]][1]
+        if target not in col_mapping.values():
+            col_mapping[col] = target
     
-    for col in df.columns:
-        col_lower = col.lower()
-        if 'id' in col_lower or 'standard' in col_lower:
-            col_mapping[col] = 'ID'
-        elif 'category' in col_lower or 'type' in col_lower:
-            col_mapping[col] = 'Category'
-        elif 'requirement' in col_lower or 'standard' in col_lower:
-            col_mapping[col] = 'Requirement'
-        elif 'description' in col_lower or 'detail' in col_lower:
-            col_mapping[col] = 'Description'
+    df = df[list(col_mapping)].rename(columns=col_mapping)
     
-    df = df.rename(columns=col_mapping)
+    # Check for required columns
+    missing = [col for col in ['ID', 'Category', 'Requirement'] if col not in df.columns]
+    if missing:
+        st.error(f"Standards file is missing required columns: {', '.join(missing)}")
+        return None
     
     # Ensure Description column exists
     if 'Description' not in df.columns:
         df['Description'] = ''
     
+    df['Category'] = df['Category'].astype('category')
     return df[['ID', 'Category', 'Requirement', 'Description']]
 
-def analyze_compliance(app_content, standards_df, api_key):
-    """Use Claude API to analyze compliance"""
+MODEL = "claude-sonnet-4-20250514"
+MAX_TOKENS = 4000
+CHUNK_SIZE = 12
+SINGLE_REQUEST_LIMIT = 15
+BATCH_POLL_INTERVAL = 10  # seconds
+MAX_CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 40  # Tier 1 rate limit
+CONTEXT_WINDOW = 200_000
+TOKEN_SAFETY_MARGIN = 2_000
+# Input tokens a single request may use while leaving room for the response
+INPUT_TOKEN_BUDGET = CONTEXT_WINDOW - MAX_TOKENS - TOKEN_SAFETY_MARGIN
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+DOC_WINDOW_WORDS = 180  # all-MiniLM-L6-v2 truncates inputs at 256 word pieces
+TOP_K_WINDOWS = 8
+RELEVANCE_THRESHOLD = 0.2
+# The relevance pre-filter needs the optional sentence-transformers package
+PREFILTER_AVAILABLE = importlib.util.find_spec('sentence_transformers') is not None
+
+def _chunk_standards(df, n=CHUNK_SIZE):
+    """Yield sub-DataFrames of at most n standards, keeping each category together where possible"""
+    # Topically coherent chunks give shorter, more accurate responses. Small categories
+    # are packed together, categories larger than n are split into even pieces
+    pending = []
+    size = 0
+    for _, group in df.groupby('Category', sort=False, observed=True):
+        if size and size + len(group) > n:
+            yield pd.concat(pending)
+            pending = []
+            size = 0
+        if len(group) > n:
+            pieces = -(-len(group) // n)
+            step = -(-len(group) // pieces)
+            for start in range(0, len(group), step):
+                yield group.iloc[start:start + step]
+        else:
+            pending.append(group)
+            size += len(group)
+    if pending:
+        yield pd.concat(pending)
+
+def build_prompt(app_content, standards_df):
+    """Build the compliance analysis prompt for a set of standards as message content blocks"""
     
     # Prepare standards text
-    standards_text = ""
-    for _, row in standards_df.iterrows():
-        standards_text += f"\n{row['ID']} - {row['Category']}: {row['Requirement']}\n"
-        if row['Description']:
-            standards_text += f"Description: {row['Description']}\n"
+    lines = (
+        standards_df['ID'].astype(str) + " - "
+        + standards_df['Category'].astype(str) + ": "
+        + standards_df['Requirement'].astype(str)
+    )
+    descriptions = standards_df['Description'].fillna('').astype(str)
+    lines += np.where(descriptions.astype(bool), "\nDescription: " + descriptions, "")
+    standards_text = "\n".join(lines.tolist())
     
-    prompt = f"""You are a compliance analyst. Review the following application documentation against the provided standards and identify any deficiencies.
+    # The documentation block is identical for every chunk, so it goes first and is
+    # marked as a cache breakpoint; only the standards block varies between requests
+    documentation = f"""You are a compliance analyst. Review the following application documentation against the provided standards and identify any deficiencies.
 
 APPLICATION DOCUMENTATION:
-{app_content}
-
-STANDARDS TO CHECK:
+{app_content}"""
+    
+    instructions = f"""STANDARDS TO CHECK:
 {standards_text}
 
 For each standard, determine if the application documentation provides sufficient evidence of compliance. 
@@ -91,36 +216,348 @@ Respond ONLY with a JSON array of findings in this exact format, with no markdow
     "recommendation": "Specific recommendation to address the deficiency"
   }}
 ]"""
+    
+    return [
+        {"type": "text", "text": documentation, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": instructions}
+    ]
+
+def parse_findings(response_text):
+    """Parse the JSON array of findings from a Claude response"""
+    # Clean up response, dropping a markdown code fence if the model added one.
+    # Every part of the pattern is optional, so it always matches
+    payload = CODE_FENCE_RE.match(response_text).group(1)
+    
+    return orjson.loads(payload.encode())
 
+def _request_params(prompt):
+    """Message parameters shared by the parallel and batch paths"""
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def _count_tokens(client, prompt):
+    """Count the input tokens of a prompt without sending it"""
+    result = client.messages.count_tokens(
+        model=MODEL,
+        messages=[
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return result.input_tokens
+
+def _split_windows(text, size=DOC_WINDOW_WORDS):
+    """Pack consecutive paragraphs into windows of roughly size words"""
+    windows = []
+    current = []
+    count = 0
+    for para in text.split('\n'):
+        words = len(para.split())
+        if current and count + words > size:
+            windows.append('\n'.join(current))
+            current = []
+            count = 0
+        current.append(para)
+        count += words
+    if current:
+        windows.append('\n'.join(current))
+    return windows
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_model():
+    """Local sentence embedding model, loaded once per process"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+def _prefilter_standards(app_content, standards_df):
+    """Score each standard against windows of the document with embedding similarity
+    
+    Returns the relevant standards, a function giving the document excerpt for a chunk
+    of them (its top-k windows in document order), and "Not Applicable" findings for
+    standards whose best window falls below RELEVANCE_THRESHOLD.
+    """
+    windows = _split_windows(app_content)
+    model = get_embedding_model()
+    standard_texts = (standards_df['Requirement'] + ' ' + standards_df['Description']).tolist()
+    # Normalized embeddings make the dot product the cosine similarity
+    standard_embeddings = model.encode(standard_texts, normalize_embeddings=True)
+    window_embeddings = model.encode(windows, normalize_embeddings=True)
+    similarity = standard_embeddings @ window_embeddings.T
+    
+    best = similarity.max(axis=1)
+    relevant = best >= RELEVANCE_THRESHOLD
+    top_windows = dict(zip(standards_df.index, np.argsort(-similarity, axis=1)[:, :TOP_K_WINDOWS]))
+    
+    def document_for(chunk):
+        # Short documents are sent whole, excerpting would not save anything
+        if len(windows) <= TOP_K_WINDOWS:
+            return app_content
+        selected = sorted(set().union(*(top_windows[i] for i in chunk.index)))
+        return '\n[...]\n'.join(windows[i] for i in selected)
+    
+    not_applicable = [
+        {
+            "standardId": row['ID'],
+            "category": row['Category'],
+            "requirement": row['Requirement'],
+            "status": "Not Applicable",
+            "finding": f"No part of the application documentation relates to this standard (best similarity {score:.2f}).",
+            "recommendation": "Confirm the standard is out of scope for this application."
+        }
+        for (_, row), score in zip(standards_df[~relevant].iterrows(), best[~relevant])
+    ]
+    return standards_df[relevant], document_for, not_applicable
+
+def _fit_to_context(client, app_content, standards_df, chunks, notes, document_for):
+    """Build one prompt per chunk, halving any chunk whose prompt exceeds the input token budget"""
+    # Every chunk is a subset of the full standards set, so if the prompt with all
+    # standards fits, every chunk's prompt fits too and one count is enough
+    total_tokens = _count_tokens(client, build_prompt(app_content, standards_df))
+    if total_tokens <= INPUT_TOKEN_BUDGET:
+        notes.append(f"Pre-flight token count: {total_tokens:,} input tokens across all standards")
+        return [build_prompt(document_for(chunk), chunk) for chunk in chunks]
+    
+    prompts = []
+    token_counts = []
+    pending = list(chunks)
+    while pending:
+        chunk = pending.pop(0)
+        prompt = build_prompt(document_for(chunk), chunk)
+        tokens = _count_tokens(client, prompt)
+        if tokens <= INPUT_TOKEN_BUDGET:
+            prompts.append(prompt)
+            token_counts.append(tokens)
+        elif len(chunk) > 1:
+            # Split in half and keep the halves in place to preserve ordering
+            middle = len(chunk) // 2
+            pending[:0] = [chunk.iloc[:middle], chunk.iloc[middle:]]
+        else:
+            raise ValueError(
+                f"Application documentation is too large to analyze: a single standard needs "
+                f"{tokens:,} input tokens, the limit is {INPUT_TOKEN_BUDGET:,}"
+            )
+    
+    notes.append(
+        f"Pre-flight token count: {len(prompts)} requests of "
+        f"{min(token_counts):,}–{max(token_counts):,} input tokens"
+    )
+    return prompts
+
+def _analyze_batch(client, prompts, on_status, on_message):
+    """Submit one request per prompt through the Message Batches API, passing each result to on_message"""
+    batch = client.messages.batches.create(
+        requests=[
+            {"custom_id": f"chunk-{i}", "params": _request_params(prompt)}
+            for i, prompt in enumerate(prompts)
+        ]
+    )
+    
+    # Batches are processed asynchronously, poll until every request has finished
+    while batch.processing_status != 'ended':
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = client.messages.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        on_status(counts.succeeded + counts.errored + counts.canceled + counts.expired)
+    
+    # Results stream back in completion order, custom_id carries the prompt index
+    failed = []
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type == 'succeeded':
+            on_message(int(entry.custom_id.split('-')[1]), entry.result.message)
+        else:
+            failed.append(f"{entry.custom_id} {entry.result.type}")
+    
+    # Raise rather than return an incomplete result, so the gaps are not memoized;
+    # the succeeded chunks have already reached the UI through on_message
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(prompts)} batch requests did not succeed: {', '.join(failed)}")
+
+def _is_retryable(exc):
+    """Retry connection errors, rate limits and server-side failures"""
+    import anthropic
+    
+    if isinstance(exc, anthropic.APIConnectionError):
+        return True
+    return isinstance(exc, anthropic.APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+async def _create_message(client, params, limiter):
+    """Create a message, retrying retryable failures with jittered exponential backoff"""
+    from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+    
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_random_exponential(multiplier=1, max=60),
+        stop=stop_after_attempt(6),
+        reraise=True
+    ):
+        with attempt:
+            async with limiter:
+                return await client.messages.create(**params)
+
+async def _analyze_chunk(client, prompt, sem, limiter):
+    """Analyze a single chunk of standards, bounded by the shared semaphore"""
+    async with sem:
+        return await _create_message(client, _request_params(prompt), limiter)
+
+async def _analyze_parallel(api_key, prompts, on_message):
+    """Send one request per prompt concurrently, passing each response to on_message as it arrives"""
+    import anthropic
+    import httpx
+    from aiolimiter import AsyncLimiter
+    
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = AsyncLimiter(REQUESTS_PER_MINUTE, 60)
+    
+    async def run(client, index):
+        message = await _analyze_chunk(client, prompts[index], sem, limiter)
+        on_message(index, message)
+    
+    # The async client is bound to this run's event loop, so it is not shared across
+    # runs; HTTP/2 lets the concurrent requests multiplex over one connection.
+    # Retries are handled by tenacity so they respect the rate limiter
+    http_client = httpx.AsyncClient(http2=True, limits=httpx.Limits(max_keepalive_connections=MAX_CONCURRENCY))
+    async with anthropic.AsyncAnthropic(api_key=api_key, max_retries=0, http_client=http_client) as client:
+        # A throwaway one-token request writes the documentation prefix to the prompt
+        # cache, so every chunk can start at once and read it back. Pre-filtered excerpts
+        # differ per chunk and can never hit the cache, so then there is nothing to warm
+        if len(prompts) > 1 and all(prompt[0] == prompts[0][0] for prompt in prompts):
+            await _create_message(client, {**_request_params(prompts[0]), "max_tokens": 1}, limiter)
+        tasks = [asyncio.ensure_future(run(client, index)) for index in range(len(prompts))]
+        if tasks:
+            # When one request fails, cancel and await the ones still in flight so none
+            # of them outlive the client, then surface the failure as is
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+
+def _run_async(coro):
+    """Run a coroutine to completion on a fresh event loop in the calling thread"""
+    loop = asyncio.new_event_loop()
     try:
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4000,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        response_text = message.content[0].text
-        
-        # Clean up response
-        response_text = response_text.strip()
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-        
-        findings = json.loads(response_text)
-        return findings
-        
-    except Exception as e:
-        st.error(f"Error during analysis: {str(e)}")
-        return None
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+def fingerprint_api_key(api_key):
+    """Non-reversible identifier for an API key, safe to use as a cache key"""
+    # The full digest, since a collision would hand one user another user's client
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_client(api_key_fingerprint, _api_key):
+    """Shared Anthropic client per API key, so its connection pool survives reruns
+    
+    Bounded so clients for mistyped or rotated keys do not accumulate in the process.
+    """
+    import anthropic
+    import httpx
+    
+    http_client = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=20))
+    return anthropic.Anthropic(api_key=_api_key, max_retries=3, http_client=http_client)
+
+@st.cache_resource
+def get_executor():
+    """Worker pool that runs analyses off the Streamlit script thread"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix='compliance-analysis')
+
+def _progress_tracker(progress):
+    """Worker callback that records progress and partial findings in a dict shared with the UI"""
+    def on_progress(done, total, new_findings):
+        progress['findings'].extend(new_findings)
+        progress.update(done=done, total=total)
+    return on_progress
+
+def _run_in_script_ctx(ctx, fn, *args):
+    """Run fn in a worker thread attached to the submitting session's script context,
+    which st.cache_data needs to look up memoized results"""
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return fn(*args)
+
+@st.cache_data(show_spinner=False)
+def analyze_compliance(app_content, standards_payload, api_key_fingerprint, use_batch, prefilter, _api_key, _on_progress=None):
+    """Use Claude API to analyze compliance, returning the findings and notes for the UI
+    
+    Results are memoized on the document text, the CSV-encoded standards and the
+    API key fingerprint; the raw key is excluded from the cache key. This runs in a
+    worker thread, so it reports back through its return value and _on_progress
+    instead of calling Streamlit elements. _on_progress(done, total, new_findings)
+    receives each chunk's findings as soon as they are parsed.
+    """
+    on_progress = _on_progress or (lambda done, total, new_findings: None)
+    notes = []
+    standards_df = pd.read_csv(io.BytesIO(standards_payload), dtype=str, keep_default_na=False)
+    
+    not_applicable = []
+    document_for = lambda chunk: app_content
+    if prefilter:
+        standards_df, document_for, not_applicable = _prefilter_standards(app_content, standards_df)
+        notes.append(f"Relevance pre-filter: {len(not_applicable)} standards marked Not Applicable without an API call")
+    
+    # Small standards sets fit comfortably in a single request
+    if len(standards_df) <= SINGLE_REQUEST_LIMIT:
+        chunks = [standards_df]
+    else:
+        chunks = _chunk_standards(standards_df)
+    
+    prompts = []
+    if len(standards_df):
+        client = get_client(api_key_fingerprint, _api_key)
+        prompts = _fit_to_context(client, app_content, standards_df, chunks, notes, document_for)
+    on_progress(0, len(prompts), not_applicable)
+    
+    chunk_findings = {}
+    cache_read_tokens = 0
+    reported = 0
+    
+    def report(done, new_findings):
+        # Batch polls count processed requests, results count parsed ones; never go backwards
+        nonlocal reported
+        reported = max(reported, done)
+        on_progress(reported, len(prompts), new_findings)
+    
+    def on_message(index, message):
+        nonlocal cache_read_tokens
+        chunk_findings[index] = parse_findings(message.content[0].text)
+        cache_read_tokens += message.usage.cache_read_input_tokens or 0
+        report(len(chunk_findings), chunk_findings[index])
+    
+    if use_batch and len(prompts) > 1:
+        _analyze_batch(client, prompts, lambda done: report(done, []), on_message)
+    elif prompts:
+        _run_async(_analyze_parallel(_api_key, prompts, on_message))
+    
+    # Partial results arrive in completion order, the final list follows prompt order
+    findings = []
+    for index in range(len(prompts)):
+        findings.extend(chunk_findings.get(index, []))
+    
+    if cache_read_tokens:
+        notes.append(f"Prompt cache hits: {cache_read_tokens:,} input tokens read from cache")
+    return findings + not_applicable, notes
+
+class _NamedBytes(io.BytesIO):
+    """In-memory file that keeps the uploaded filename, which read_standards_file dispatches on"""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def read_docx_cached(data):
+    """Extract text from uploaded DOCX bytes, memoized on their hash across reruns"""
+    return read_docx(io.BytesIO(data))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def read_standards_cached(data, name):
+    """Read standards from uploaded file bytes, memoized on their hash across reruns"""
+    return read_standards_file(_NamedBytes(data, name))
 
 # Main UI
 st.title("📋 Application Compliance Checker")
@@ -136,6 +573,17 @@ with st.sidebar:
         st.success("✓ API Key configured")
     else:
         api_key = st.text_input("Anthropic API Key", type="password", help="Enter your Anthropic API key")
+    use_batch = st.toggle(
+        "Use Message Batches API",
+        help="Roughly half the cost, but results can take minutes to hours to come back"
+    )
+    prefilter = st.toggle(
+        "Skip irrelevant standards",
+        disabled=not PREFILTER_AVAILABLE,
+        help="Uses local embeddings to mark standards unrelated to the document as Not Applicable "
+             "and to send only the most relevant parts of the document"
+             + ("" if PREFILTER_AVAILABLE else ". Requires the sentence-transformers package.")
+    )
     st.markdown("---")
     st.markdown("### Instructions")
     st.markdown("""
@@ -159,21 +607,28 @@ with tab1:
         app_file = st.file_uploader("Upload Application DOCX", type=['docx'], key="app_upload")
         
         if app_file:
-            with st.spinner("Reading document..."):
-                st.session_state.app_content = read_docx(app_file)
-                st.success(f"✓ Loaded: {app_file.name}")
-                st.info(f"Content length: {len(st.session_state.app_content)} characters")
+            # Reruns with the same upload (e.g. while polling an analysis) skip even hashing the
+            # bytes; a new upload with identical contents is still served from the cache
+            if st.session_state.app_file_id != app_file.file_id:
+                with st.spinner("Reading document..."):
+                    st.session_state.app_content = read_docx_cached(app_file.getvalue())
+                    st.session_state.app_file_id = app_file.file_id
+            st.success(f"✓ Loaded: {app_file.name}")
+            st.info(f"Content length: {len(st.session_state.app_content)} characters")
     
     with col2:
         st.subheader("Standards File")
         standards_file = st.file_uploader("Upload Standards (CSV or Excel)", type=['csv', 'xlsx', 'xls'], key="standards_upload")
         
         if standards_file:
-            with st.spinner("Reading standards..."):
-                st.session_state.standards = read_standards_file(standards_file)
-                if st.session_state.standards is not None:
-                    st.success(f"✓ Loaded: {standards_file.name}")
-                    st.info(f"Standards loaded: {len(st.session_state.standards)}")
+            # Unreadable files are re-read each rerun so their error stays visible
+            if st.session_state.standards_file_id != standards_file.file_id or st.session_state.standards is None:
+                with st.spinner("Reading standards..."):
+                    st.session_state.standards = read_standards_cached(standards_file.getvalue(), standards_file.name)
+                    st.session_state.standards_file_id = standards_file.file_id
+            if st.session_state.standards is not None:
+                st.success(f"✓ Loaded: {standards_file.name}")
+                st.info(f"Standards loaded: {len(st.session_state.standards)}")
 
 with tab2:
     st.header("Review Loaded Data")
@@ -193,21 +648,70 @@ with tab2:
     
     st.markdown("---")
     
+    # Collect a finished analysis before the button renders, so it is enabled again on this run
+    future = st.session_state.analysis_future
+    finished = future is not None and future.done()
+    if finished:
+        st.session_state.analysis_future = None
+    
     if st.session_state.app_content and st.session_state.standards is not None:
         if not api_key:
             st.error("⚠️ Please enter your Anthropic API key in the sidebar")
         else:
-            if st.button("🔍 Analyze Compliance", type="primary", use_container_width=True):
-                with st.spinner("Analyzing compliance... This may take a minute."):
-                    findings = analyze_compliance(
-                        st.session_state.app_content,
-                        st.session_state.standards,
-                        api_key
-                    )
-                    if findings:
-                        st.session_state.findings = findings
-                        st.success("Analysis complete! View results in the 'Analysis Results' tab.")
-                        st.balloons()
+            running = st.session_state.analysis_future is not None
+            if st.button("🔍 Analyze Compliance", type="primary", use_container_width=True, disabled=running):
+                # The worker updates this dict in place; the UI reads it on each poll. It lives
+                # in session state so completed chunks survive a failure later in the run
+                progress = {'done': 0, 'total': 0, 'batch': use_batch, 'findings': []}
+                st.session_state.analysis_progress = progress
+                st.session_state.findings = None
+                st.session_state.analysis_future = get_executor().submit(
+                    _run_in_script_ctx,
+                    get_script_run_ctx(),
+                    analyze_compliance,
+                    st.session_state.app_content,
+                    st.session_state.standards.to_csv(index=False).encode(),
+                    fingerprint_api_key(api_key),
+                    use_batch,
+                    prefilter,
+                    api_key,
+                    _progress_tracker(progress)
+                )
+    
+    if finished:
+        try:
+            findings, notes = future.result()
+        except Exception as e:
+            # Raised outside the cached function so failures are not memoized
+            st.error(f"Error during analysis: {str(e)}")
+            partial = st.session_state.analysis_progress['findings']
+            if partial:
+                st.session_state.findings = list(partial)
+                st.warning(f"Kept {len(partial)} findings from the requests that completed before the error.")
+        else:
+            for note in notes:
+                st.caption(note)
+            if findings:
+                st.session_state.findings = findings
+                st.success("Analysis complete! View results in the 'Analysis Results' tab.")
+                st.balloons()
+    elif st.session_state.analysis_future is not None:
+        progress = st.session_state.analysis_progress
+        if progress['batch']:
+            label = "Batch submitted... This may take several minutes."
+        else:
+            label = "Analyzing compliance... This may take a minute."
+        if progress['total']:
+            label += f" ({progress['done']}/{progress['total']} requests complete)"
+            st.progress(progress['done'] / progress['total'], text=label)
+        else:
+            st.progress(0, text=label)
+        
+        # Show findings as chunks complete, the results tab fills in progressively too
+        partial = list(progress['findings'])
+        if partial:
+            st.session_state.findings = partial
+            st.dataframe(pd.DataFrame(partial), use_container_width=True)
 
 with tab3:
     st.header("Analysis Results")
@@ -216,34 +720,39 @@ with tab3:
         findings_df = pd.DataFrame(st.session_state.findings)
         
         # Summary metrics
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         
-        deficient = len(findings_df[findings_df['status'] == 'Deficient'])
-        partial = len(findings_df[findings_df['status'] == 'Partial'])
-        compliant = len(findings_df[findings_df['status'] == 'Compliant'])
+        counts = findings_df['status'].value_counts()
+        deficient = counts.get('Deficient', 0)
+        partial = counts.get('Partial', 0)
+        compliant = counts.get('Compliant', 0)
+        not_applicable = counts.get('Not Applicable', 0)
         
         col1.metric("🔴 Deficient", deficient)
         col2.metric("🟡 Partial", partial)
         col3.metric("🟢 Compliant", compliant)
+        col4.metric("⚪ Not Applicable", not_applicable)
         
         st.markdown("---")
         
         # Filter options
         status_filter = st.multiselect(
             "Filter by Status",
-            options=['Deficient', 'Partial', 'Compliant'],
+            options=['Deficient', 'Partial', 'Compliant', 'Not Applicable'],
             default=['Deficient', 'Partial']
         )
         
-        filtered_findings = findings_df[findings_df['status'].isin(status_filter)]
+        status_color = {
+            'Deficient': '🔴',
+            'Partial': '🟡',
+            'Compliant': '🟢',
+            'Not Applicable': '⚪'
+        }
         
-        # Display findings
-        for idx, finding in filtered_findings.iterrows():
-            status_color = {
-                'Deficient': '🔴',
-                'Partial': '🟡',
-                'Compliant': '🟢'
-            }
+        # Display findings straight from the raw list, the DataFrame is only for metrics and exports
+        for finding in st.session_state.findings:
+            if finding['status'] not in status_filter:
+                continue
             
             with st.expander(f"{status_color[finding['status']]} {finding['standardId']} - {finding['category']}"):
                 st.markdown(f"**Requirement:** {finding['requirement']}")
@@ -269,9 +778,16 @@ with tab3:
         
         with col2:
             # Export to Excel
+            import xlsxwriter
+            
             output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                findings_df.to_excel(writer, index=False, sheet_name='Findings')
+            # constant_memory flushes each row once the next one starts, so rows are written
+            # in order here; pandas' to_excel writes column by column, which that mode drops
+            with xlsxwriter.Workbook(output, {'constant_memory': True}) as workbook:
+                worksheet = workbook.add_worksheet('Findings')
+                worksheet.write_row(0, 0, findings_df.columns)
+                for row, values in enumerate(findings_df.fillna('').itertuples(index=False), start=1):
+                    worksheet.write_row(row, 0, values)
             excel_data = output.getvalue()
             
             st.download_button(
@@ -286,4 +802,9 @@ with tab3:
 
 # Footer
 st.markdown("---")
-st.markdown("*Powered by Claude AI*")
\ No newline at end of file
+st.markdown("*Powered by Claude AI*")
+
+# Poll the background analysis; rerunning at the end keeps every tab rendered meanwhile
+if st.session_state.analysis_future is not None:
+    time.sleep(0.5)
+    st.rerun()
\ No newline at end of file